@@ -32,6 +32,19 @@ class Config:
 
     # Model
     model_path: str = os.getenv("MODEL_PATH", "models/best.pt")
+    # Accelerated export format: auto (TensorRT on NVIDIA, OpenVINO on Intel),
+    # engine, openvino, onnx, ... or none to run the .pt weights directly
+    model_export: str = os.getenv("MODEL_EXPORT", "auto")
+    # Inference precision: auto (fp16 on CUDA, fp32 otherwise), fp32, fp16, int8
+    model_precision: str = os.getenv("MODEL_PRECISION", "auto")
+    # Dataset yaml with representative images, required for int8 calibration
+    model_calibration_data: str = os.getenv("MODEL_CALIBRATION_DATA", "calib.yaml")
+    # Fixed inference/export input size (multiple of 32)
+    model_imgsz: int = int(os.getenv("MODEL_IMGSZ", "640"))
+    # TensorRT builder workspace in GiB
+    model_trt_workspace: float = float(os.getenv("MODEL_TRT_WORKSPACE", "4"))
+    # Images per model call; 0 sizes it from GPU memory at startup (1 for OpenVINO)
+    model_batch_size: int = int(os.getenv("MODEL_BATCH_SIZE", "0"))
 
 
 # Global config instance
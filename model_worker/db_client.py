@@ -4,14 +4,19 @@ Database client for PostgreSQL operations.
 Updates job status and saves analysis results.
 """
 
-import json
+from datetime import datetime
+from typing import Optional
 from urllib.parse import urlparse
 
-import psycopg2
-from psycopg2.extras import Json
+import orjson
+from psycopg.types.json import Jsonb, set_json_dumps
+from psycopg_pool import ConnectionPool
 
 from config import config
 
+# Serialize jsonb parameters (raw_data) with orjson instead of stdlib json
+set_json_dumps(orjson.dumps)
+
 
 def parse_database_url(url: str) -> dict:
     """Parse DATABASE_URL into connection parameters."""
@@ -19,16 +24,37 @@ def parse_database_url(url: str) -> dict:
     return {
         "host": parsed.hostname or "localhost",
         "port": parsed.port or 5432,
-        "database": parsed.path.lstrip("/") or "cell_analysis",
+        "dbname": parsed.path.lstrip("/") or "cell_analysis",
         "user": parsed.username or "postgres",
         "password": parsed.password or "postgres",
     }
 
 
+# Connection parameters, parsed once
+DB_PARAMS = parse_database_url(config.database_url)
+
+# Fail fast when PostgreSQL is unreachable instead of waiting on the
+# default TCP timeouts
+CONNECT_TIMEOUT = 3
+POOL_TIMEOUT = 10
+
+# Process-wide connection pool, created once at startup
+pool = ConnectionPool(
+    kwargs={**DB_PARAMS, "connect_timeout": CONNECT_TIMEOUT},
+    min_size=1,
+    max_size=8,
+    timeout=POOL_TIMEOUT,
+    open=True,
+)
+
+
 def get_connection():
-    """Get a new database connection."""
-    params = parse_database_url(config.database_url)
-    return psycopg2.connect(**params)
+    """Check out a pooled database connection for the duration of the block.
+
+    The transaction is committed on success and rolled back on error, so the
+    connection always goes back to the pool clean.
+    """
+    return pool.connection()
 
 
 def start_processing(job_id: int) -> None:
@@ -38,10 +64,11 @@ def start_processing(job_id: int) -> None:
         job_id: The job ID to update
     """
     with get_connection() as conn:
-        with conn.cursor() as cur:
+        with conn.cursor(binary=True) as cur:
             cur.execute(
                 "UPDATE jobs SET status='processing', started_at=NOW() WHERE job_id=%s",
                 (job_id,),
+                prepare=True,
             )
         conn.commit()
 
@@ -54,20 +81,27 @@ def save_result(
     avg_confidence: float,
     raw_data: dict,
     summary: str,
+    started_at: Optional[datetime] = None,
 ) -> None:
     """Save analysis result and mark job as completed.
 
+    Runs in a single transaction; ``started_at`` is recorded here as well so
+    the worker does not need a separate ``start_processing`` round-trip.
+    Statements are prepared server-side once per connection and raw_data is
+    sent as binary jsonb.
+
     Args:
         job_id: The job ID
         count_viable: Number of viable cells detected
         count_apoptosis: Number of apoptotic cells detected
         count_other: Number of other cells detected
         avg_confidence: Average confidence score
-        raw_data: Raw detection data (bounding boxes)
+        raw_data: Raw detection data (bounding boxes, one list per field)
         summary: Human-readable summary
+        started_at: When processing began (defaults to now)
     """
     with get_connection() as conn:
-        with conn.cursor() as cur:
+        with conn.cursor(binary=True) as cur:
             # Insert analysis result
             cur.execute(
                 """
@@ -82,29 +116,44 @@ def save_result(
                     count_apoptosis,
                     count_other,
                     avg_confidence,
-                    Json(raw_data),
+                    Jsonb(raw_data),
                     summary,
                 ),
+                prepare=True,
             )
             # Mark job as completed
             cur.execute(
-                "UPDATE jobs SET status='completed', finished_at=NOW() WHERE job_id=%s",
-                (job_id,),
+                """
+                UPDATE jobs SET status='completed',
+                  started_at=COALESCE(started_at, %s, NOW()), finished_at=NOW()
+                WHERE job_id=%s
+                """,
+                (started_at, job_id),
+                prepare=True,
             )
         conn.commit()
 
 
-def fail_job(job_id: int, error_message: str) -> None:
+def fail_job(
+    job_id: int, error_message: str, started_at: Optional[datetime] = None
+) -> None:
     """Mark job as failed with error message.
 
     Args:
         job_id: The job ID
         error_message: Description of the failure
+        started_at: When processing began (defaults to now)
     """
     with get_connection() as conn:
-        with conn.cursor() as cur:
+        with conn.cursor(binary=True) as cur:
             cur.execute(
-                "UPDATE jobs SET status='failed', finished_at=NOW(), error_message=%s WHERE job_id=%s",
-                (error_message, job_id),
+                """
+                UPDATE jobs SET status='failed',
+                  started_at=COALESCE(started_at, %s, NOW()), finished_at=NOW(),
+                  error_message=%s
+                WHERE job_id=%s
+                """,
+                (started_at, error_message, job_id),
+                prepare=True,
             )
         conn.commit()
@@ -1,24 +1,287 @@
 """
 YOLO Model Inference Module.
 
-Loads the trained model and runs inference on cell images.
+Loads the trained model on first use and runs inference on cell images.
 """
 
-import io
+import gc
+import importlib.util
 import logging
-from typing import Dict, List, Any
+import platform
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from PIL import Image
+import cv2
+import numpy as np
+import torch
 from ultralytics import YOLO
 
 from config import config
 
 logger = logging.getLogger(__name__)
 
-# Load model once at startup
-logger.info(f"Loading model from {config.model_path}")
-model = YOLO(config.model_path)
-logger.info("Model loaded successfully")
+# Fixed inference input size. Every image is letterboxed to exactly this
+# square (rect=False) and exported models are built for it, so set it to
+# match the camera's images.
+IMGSZ = config.model_imgsz
+
+# Batch size used when it cannot be sized from GPU memory (e.g. the PyTorch
+# fallback on CPU)
+DEFAULT_BATCH_SIZE = 4
+# Upper bound and share of total GPU memory for automatic batch sizing
+MAX_AUTO_BATCH_SIZE = 16
+AUTOBATCH_FRACTION = 0.6
+
+
+def _is_intel_cpu() -> bool:
+    """Return True when running on an Intel CPU (OpenVINO's best target)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            return "GenuineIntel" in f.read()
+    except OSError:
+        return "Intel" in platform.processor()
+
+
+def _has_runtime(package: str) -> bool:
+    """Return True if ``package`` is installed in this image.
+
+    Ultralytics pip-installs a missing export runtime on first use, which
+    would run inside every fresh container (and fail offline), so "auto"
+    only picks formats whose runtime is already installed.
+    """
+    return importlib.util.find_spec(package) is not None
+
+
+def _export_format() -> Optional[str]:
+    """Pick the accelerated export format for this machine.
+
+    Returns:
+        "engine" (TensorRT) on NVIDIA GPUs, "openvino" on Intel CPUs, when
+        their runtime is installed, or None to run the PyTorch weights
+        directly
+    """
+    if config.model_export != "auto":
+        return None if config.model_export == "none" else config.model_export
+
+    if torch.cuda.is_available() and _has_runtime("tensorrt"):
+        return "engine"
+    if _is_intel_cpu() and _has_runtime("openvino"):
+        return "openvino"
+    return None
+
+
+def _precision() -> str:
+    """Resolve the configured precision.
+
+    "auto" means FP16 on CUDA and FP32 elsewhere. INT8 is only used when
+    explicitly requested, since it needs calibration data and should be
+    validated on the deployment target first (FP16/INT8 can regress on some
+    devices such as the Jetson Nano).
+    """
+    if config.model_precision != "auto":
+        return config.model_precision
+    return "fp16" if torch.cuda.is_available() else "fp32"
+
+
+def _auto_batch_size(
+    model: YOLO, weights: Path, fmt: Optional[str], precision: str
+) -> int:
+    """Pick how many images to run through the model at once.
+
+    Like Ultralytics AutoBatch: profile ``model``'s peak CUDA memory at batch
+    sizes 1 and 2 to estimate the per-image cost, then fit as many images as
+    AUTOBATCH_FRACTION of the GPU memory allows. The result is sized from
+    total (not free) memory and rounded down to a power of two, so the same
+    GPU always gets the same batch size and reuses its cached export.
+    OpenVINO (CPU) runs use batch 1, since batching gains little there.
+    MODEL_BATCH_SIZE overrides all of this.
+    """
+    if config.model_batch_size > 0:
+        return config.model_batch_size
+    if fmt == "openvino":
+        return 1
+    if not torch.cuda.is_available() or weights.suffix != ".pt":
+        return DEFAULT_BATCH_SIZE
+
+    try:
+        dummy = np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8)
+        peaks = []
+        for batch in (1, 2):
+            torch.cuda.reset_peak_memory_stats()
+            model(
+                [dummy] * batch,
+                imgsz=IMGSZ,
+                rect=False,
+                half=precision == "fp16",
+                verbose=False,
+            )
+            peaks.append(torch.cuda.max_memory_allocated())
+        per_image = max(peaks[1] - peaks[0], 1)
+        total = torch.cuda.mem_get_info()[1]
+        batch_size = int(total * AUTOBATCH_FRACTION / per_image)
+        logger.info(
+            f"AutoBatch: {per_image / 2**20:.0f} MiB/image, "
+            f"{total / 2**30:.1f} GiB total"
+        )
+    except Exception as e:
+        logger.warning(f"AutoBatch failed, using batch size {DEFAULT_BATCH_SIZE}: {e}")
+        return DEFAULT_BATCH_SIZE
+    finally:
+        torch.cuda.empty_cache()
+
+    batch_size = max(1, min(batch_size, MAX_AUTO_BATCH_SIZE))
+    return 1 << (batch_size.bit_length() - 1)
+
+
+def _exported_path(weights: Path, fmt: str, precision: str, batch_size: int) -> Path:
+    """Where the exported artifact for ``weights`` is cached.
+
+    The precision, input size and batch size (a range for dynamic-batch
+    exports) are part of the name so changing any of them never reuses a
+    stale export.
+    """
+    batch = "b1" if batch_size == 1 else f"b1-{batch_size}"
+    tag = f"{precision}_{IMGSZ}_{batch}"
+    if fmt == "openvino":
+        return weights.with_name(f"{weights.stem}_{tag}_openvino_model")
+    return weights.with_name(f"{weights.stem}_{tag}.{fmt}")
+
+
+def _export(
+    model: YOLO, fmt: str, precision: str, batch_size: int, target: Path
+) -> Path:
+    """Export the PyTorch ``model`` to ``fmt`` and move the artifact to ``target``."""
+    # Batch sizes above 1 get a dynamic batch axis (up to batch_size), so a
+    # lone job runs as a batch of one instead of being padded to a full
+    # batch. Ultralytics makes the spatial axes dynamic too, but inputs are
+    # always IMGSZ x IMGSZ, the shape TensorRT tunes its kernels for.
+    export_args = {
+        "format": fmt,
+        "imgsz": IMGSZ,
+        "batch": batch_size,
+        "dynamic": batch_size > 1,
+    }
+    if fmt == "engine":
+        export_args["workspace"] = config.model_trt_workspace
+    if precision == "fp16":
+        export_args["half"] = True
+    elif precision == "int8":
+        # INT8 calibration runs over the images referenced by this dataset yaml
+        export_args["int8"] = True
+        export_args["data"] = config.model_calibration_data
+    exported = Path(model.export(**export_args))
+    # Replace any stale export (a directory for OpenVINO)
+    if target.is_dir():
+        shutil.rmtree(target)
+    return exported.replace(target)
+
+
+def _exported_model(
+    model: YOLO, weights: Path, fmt: str, precision: str, batch_size: int
+) -> Optional[Path]:
+    """Return the accelerated export of ``model``, exporting it if needed.
+
+    The exported artifact is cached next to the weights and rebuilt when the
+    weights are newer.
+
+    Returns:
+        Path of the export, or None if exporting failed
+    """
+    exported = _exported_path(weights, fmt, precision, batch_size)
+    try:
+        if not exported.exists() or exported.stat().st_mtime < weights.stat().st_mtime:
+            logger.info(f"Exporting model to {fmt} ({precision}), one-time...")
+            exported = _export(model, fmt, precision, batch_size, exported)
+    except Exception as e:
+        logger.warning(f"Model export to {fmt} failed, using PyTorch weights: {e}")
+        return None
+    return exported
+
+
+def _load_model(precision: str) -> Tuple[YOLO, int]:
+    """Load the model, exporting it to an accelerated format when possible.
+
+    A single PyTorch model is loaded for batch sizing, export and the
+    fallback, and it is released before an exported model is loaded, so
+    the weights are never on the GPU twice. Any export failure falls back
+    to the PyTorch model.
+
+    Returns:
+        The model and its batch size
+    """
+    weights = Path(config.model_path)
+    fmt = _export_format() if weights.suffix == ".pt" else None
+    model = YOLO(str(weights))
+    batch_size = _auto_batch_size(model, weights, fmt, precision)
+    exported = None
+    if fmt is not None:
+        exported = _exported_model(model, weights, fmt, precision, batch_size)
+    if exported is None:
+        return model, batch_size
+
+    del model
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    try:
+        logger.info(f"Loading exported model from {exported}")
+        return YOLO(str(exported), task="detect"), batch_size
+    except Exception as e:
+        logger.warning(f"Loading {exported} failed, using PyTorch weights: {e}")
+        return YOLO(str(weights)), batch_size
+
+
+def _warmup(model: YOLO, precision: str, batch_size: int) -> None:
+    """Run one dummy forward pass so the first real job skips the cold start.
+
+    The first call pays for CUDA context setup, cuDNN autotuning and lazy
+    kernel initialization (or TensorRT execution context creation).
+    """
+    dummy = np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8)
+    model(
+        [dummy] * batch_size,
+        imgsz=IMGSZ,
+        rect=False,
+        half=precision == "fp16",
+        verbose=False,
+    )
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """The model together with the settings it was prepared for."""
+
+    model: YOLO
+    precision: str
+    # Most images per model call
+    batch_size: int
+
+
+_loaded: Optional[LoadedModel] = None
+_load_lock = threading.Lock()
+
+
+def get_model() -> LoadedModel:
+    """Return the model, loading it on first use.
+
+    Loading (export, batch sizing and warmup included) takes seconds and
+    hundreds of MB, so it is deferred until something actually needs the
+    model rather than paid by every importer of this module.
+    """
+    global _loaded
+    if _loaded is None:
+        with _load_lock:
+            if _loaded is None:
+                precision = _precision()
+                logger.info(f"Loading model from {config.model_path} ({precision})")
+                model, batch_size = _load_model(precision)
+                _warmup(model, precision, batch_size)
+                _loaded = LoadedModel(model, precision, batch_size)
+                logger.info(f"Model loaded successfully (batch size {batch_size})")
+    return _loaded
 
 # Class mapping - adjust based on your model training
 # Map Model Class ID -> System Category (normal, apoptosis, other)
@@ -29,6 +292,64 @@ CLASS_NAMES = {
     2: "other"       # Uncertain -> other
 }
 
+# Model class ID -> count bin (viable=0, apoptosis=1, other=2), so counts are
+# a single array tally. "normal" maps to the viable bin for DB compatibility.
+CLASS_TO_BIN = np.array([1, 0, 2], dtype=np.int32)
+# CLASS_NAMES as an array, for vectorized lookup
+CLASS_NAME_ARRAY = np.array([CLASS_NAMES[i] for i in range(len(CLASS_NAMES))])
+
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    """Decode image bytes into a BGR array ready for the model.
+
+    Uses OpenCV (libjpeg-turbo for JPEG), which decodes faster than PIL and
+    releases the GIL, so callers can decode on their own thread (e.g. a
+    download worker) instead of inside the model call on the inference
+    thread. Ultralytics takes NumPy input as BGR, so no color conversion is
+    needed.
+
+    Args:
+        image_bytes: Raw image content as bytes
+
+    Returns:
+        Decoded HxWx3 uint8 BGR image
+
+    Raises:
+        ValueError: If the bytes are not a decodable image
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+def run_batch_inference(images: List[np.ndarray]) -> Iterator[Dict[str, Any]]:
+    """Run YOLO inference on a batch of images in a single model call.
+
+    Args:
+        images: Images already decoded with decode_image (at most the
+            model's batch_size)
+
+    Yields:
+        One result dictionary per image, in input order. Same keys as
+        run_inference, except the summary is not formatted; call
+        format_summary(result["bins"]) when it is needed.
+    """
+    loaded = get_model()
+
+    # Run inference on the whole batch, streaming results as they are ready.
+    # rect=False keeps the input at exactly IMGSZ x IMGSZ, the shape exported
+    # models are tuned for. half=True runs the PyTorch fallback in FP16 too
+    # (exported models have their precision baked in)
+    for results in loaded.model(
+        images,
+        stream=True,
+        imgsz=IMGSZ,
+        rect=False,
+        half=loaded.precision == "fp16",
+    ):
+        yield _parse_results(results)
+
+
 def run_inference(image_bytes: bytes) -> Dict[str, Any]:
     """Run YOLO inference on image bytes.
 
@@ -39,66 +360,84 @@ def run_inference(image_bytes: bytes) -> Dict[str, Any]:
         Dictionary containing:
         - counts: Dict with viable, apoptosis, other counts (viable = normal cells for DB)
         - avg_confidence: Average confidence score
-        - bounding_boxes: List of detection bounding boxes (class names: normal, apoptosis, other)
+        - bounding_boxes: Detection bounding boxes as parallel lists keyed by
+          class, confidence, x, y, width, height (class names: normal,
+          apoptosis, other)
+        - bins: NumPy array of counts in (viable, apoptosis, other) order
         - summary: Human-readable summary string
     """
-    # Load image from bytes
-    image = Image.open(io.BytesIO(image_bytes))
-
-    # Run inference
-    results = model(image)[0]
-
-    # Parse results
-    counts = {"viable": 0, "apoptosis": 0, "other": 0}
-    bounding_boxes: List[Dict] = []
-    total_confidence = 0.0
-
-    for box in results.boxes:
-        cls_id = int(box.cls[0])
-        confidence = float(box.conf[0])
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-
-        # Map class ID to name
-        class_name = CLASS_NAMES.get(cls_id, "other")
-        # For counts dict, map "normal" -> "viable" for DB column compatibility
-        count_key = "viable" if class_name == "normal" else class_name
-        counts[count_key] += 1
-        total_confidence += confidence
-
-        bounding_boxes.append(
-            {
-                "class": class_name,
-                "confidence": round(confidence, 3),
-                "x": int(x1),
-                "y": int(y1),
-                "width": int(x2 - x1),
-                "height": int(y2 - y1),
-            }
-        )
+    result = next(run_batch_inference([decode_image(image_bytes)]))
+    result["summary"] = format_summary(result["bins"])
+    return result
+
+
+def _parse_results(results) -> Dict[str, Any]:
+    """Convert a single Ultralytics result into the worker's result dictionary."""
+    # One device-to-host copy per tensor instead of several per box
+    boxes = results.boxes
+    cls = boxes.cls.cpu().numpy().astype(np.int32)
+    conf = boxes.conf.cpu().numpy()
+    xyxy = boxes.xyxy.cpu().numpy()
+
+    # Unknown class IDs count as "other"
+    cls = np.minimum(cls, len(CLASS_NAME_ARRAY) - 1)
+
+    # Tally classes
+    bins = np.bincount(CLASS_TO_BIN[cls], minlength=3)
+    counts = {
+        "viable": int(bins[0]),
+        "apoptosis": int(bins[1]),
+        "other": int(bins[2]),
+    }
+    total_confidence = float(conf.sum())
+
+    # Bounding boxes as columns (struct-of-arrays), rounded and converted in
+    # bulk. Confidences are rounded as float64 so they stay short once
+    # serialized; width/height truncate like int(x2 - x1)
+    xy = xyxy[:, :2].astype(np.int32)
+    wh = (xyxy[:, 2:] - xyxy[:, :2]).astype(np.int32)
+    bounding_boxes: Dict[str, List] = {
+        "class": CLASS_NAME_ARRAY[cls].tolist(),
+        "confidence": np.round(conf.astype(np.float64), 3).tolist(),
+        "x": xy[:, 0].tolist(),
+        "y": xy[:, 1].tolist(),
+        "width": wh[:, 0].tolist(),
+        "height": wh[:, 1].tolist(),
+    }
 
     total_cells = sum(counts.values())
     avg_confidence = total_confidence / total_cells if total_cells > 0 else 0.0
 
-    # Generate Thai summary
-    if total_cells > 0:
-        normal_pct = counts["viable"] / total_cells * 100  # viable = normal cells
-        apoptosis_pct = counts["apoptosis"] / total_cells * 100
-        other_pct = counts["other"] / total_cells * 100
-    else:
-        normal_pct = apoptosis_pct = other_pct = 0.0
-
-    summary = (
-        f"พบเซลล์ทั้งหมด {total_cells} เซลล์: "
-        f"Normal {counts['viable']} ({normal_pct:.1f}%), "
-        f"Apoptosis {counts['apoptosis']} ({apoptosis_pct:.1f}%), "
-        f"Other {counts['other']} ({other_pct:.1f}%)"
-    )
-
     logger.info(f"Inference complete: {total_cells} cells detected")
 
     return {
         "counts": counts,
         "avg_confidence": round(avg_confidence, 3),
         "bounding_boxes": bounding_boxes,
-        "summary": summary,
+        "bins": bins,
     }
+
+
+def format_summary(bins: np.ndarray) -> str:
+    """Build the human-readable (Thai) summary for a result.
+
+    Kept out of the model call path so the worker can format it on its
+    database writer thread rather than the inference thread.
+
+    Args:
+        bins: Per-bin cell counts (viable, apoptosis, other) from a result
+
+    Returns:
+        Summary string with counts and percentages
+    """
+    total_cells = int(bins.sum())
+    # viable = normal cells
+    pcts = bins * (100.0 / max(total_cells, 1))
+    return "".join(
+        (
+            f"พบเซลล์ทั้งหมด {total_cells} เซลล์: ",
+            f"Normal {bins[0]} ({pcts[0]:.1f}%), ",
+            f"Apoptosis {bins[1]} ({pcts[1]:.1f}%), ",
+            f"Other {bins[2]} ({pcts[2]:.1f}%)",
+        )
+    )
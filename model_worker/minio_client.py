@@ -2,26 +2,52 @@
 MinIO/S3 client for downloading images.
 """
 
-import io
+import os
+from functools import lru_cache
 from urllib.parse import urlparse
 
+import certifi
+import urllib3
 from minio import Minio
+from urllib3.util.retry import Retry
 
 from config import config
 
+# Bounded so a stalled MinIO socket cannot block a download thread (and, with
+# only a few of them, the whole pipeline) indefinitely
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
 
+
+@lru_cache(maxsize=None)
 def get_minio_client() -> Minio:
-    """Create and return a MinIO client instance."""
+    """Return the shared MinIO client, creating it on first use."""
     parsed = urlparse(config.minio_endpoint)
     # Remove port from netloc for host
     host_with_port = parsed.netloc
     secure = parsed.scheme == "https"
 
+    # Explicit keep-alive pool shared by all downloads (sized for concurrent
+    # download threads), so requests reuse open TCP/TLS connections
+    http_client = urllib3.PoolManager(
+        num_pools=4,
+        maxsize=16,
+        block=False,
+        timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+        # Like MinIO's default client, also retry transient server errors
+        retries=Retry(
+            total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]
+        ),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+    )
+
     return Minio(
         host_with_port,
         access_key=config.minio_access_key,
         secret_key=config.minio_secret_key,
         secure=secure,
+        http_client=http_client,
     )
 
 
@@ -34,10 +60,10 @@ def download_image(s3_key: str) -> bytes:
     Returns:
         Image content as bytes
     """
-    client = get_minio_client()
-    response = client.get_object(config.minio_bucket, s3_key)
+    response = get_minio_client().get_object(config.minio_bucket, s3_key)
     try:
         return response.read()
     finally:
-        response.close()
+        # Return the connection to the pool for reuse; close() would drop
+        # the underlying socket and force a new handshake next time
         response.release_conn()
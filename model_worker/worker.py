@@ -4,15 +4,24 @@ Model Worker - Main Entry Point
 Consumes analysis jobs from RabbitMQ and processes them using YOLO model.
 """
 
-import json
+import functools
 import logging
+import queue
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, List, Tuple
 
+import orjson
 import pika
+import psycopg
 
 from config import config
-from db_client import fail_job, save_result, start_processing
-from inference import run_inference
+from db_client import fail_job, save_result
+from inference import decode_image, format_summary, get_model, run_batch_inference
 from minio_client import download_image
 
 # Configure logging
@@ -23,65 +32,279 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def process_message(ch, method, properties, body):
-    """Process a single analysis job message.
+# Continuous batching: the inference thread takes whatever images are ready
+# (up to the model's batch size, sized to GPU memory when the model loads)
+# the moment the model is free, instead of waiting to fill a fixed-size batch
+DOWNLOAD_WORKERS = 4
+# How long pipeline threads block on an empty queue before re-checking for
+# shutdown
+POLL_INTERVAL = 0.5
+# Consecutive database failures after which the worker stops consuming and
+# exits, so it gets restarted instead of hanging on an unreachable database
+MAX_DB_FAILURES = 5
+
+
+def fetch_image(s3_key: str) -> Any:
+    """Download and decode a job's image (runs on a download thread).
 
     Args:
-        ch: Channel
-        method: Method frame
-        properties: Message properties
-        body: Message body bytes
+        s3_key: The object key in the bucket
+
+    Returns:
+        Decoded image ready for inference
     """
-    job_id = None
-    try:
-        # Parse message
-        message = json.loads(body)
-        job_id = message["job_id"]
-        s3_key = message["s3_key"]
+    image_bytes = download_image(s3_key)
+    logger.info(f"Downloaded {len(image_bytes)} bytes from {s3_key}")
+    return decode_image(image_bytes)
+
+
+@dataclass
+class Job:
+    """A parsed analysis job moving through the pipeline."""
+
+    delivery_tag: int
+    job_id: int
+    s3_key: str
+    started_at: datetime
+
+
+class BatchScheduler:
+    """Feeds downloaded images to the model in continuously formed batches.
+
+    Jobs move through a three-stage pipeline so network, GPU and database
+    work overlap:
+
+    1. The pika thread parses messages and hands downloads to a thread pool,
+       which also decodes the images; they land in the ``ready`` queue.
+    2. A single inference thread drains ``ready`` in batches, runs the model
+       and puts each result on the ``results`` queue.
+    3. A writer thread formats the summary and saves results to PostgreSQL.
+
+    Acks and nacks are marshalled back to the pika thread with
+    ``add_callback_threadsafe``, since pika channels are not thread-safe.
+    Failed jobs are nacked immediately; their database update runs on a
+    separate small pool so an unreachable database never stalls the queue.
+    """
+
+    def __init__(self, connection, channel, max_batch: int):
+        self.connection = connection
+        self.channel = channel
+        self.max_batch = max_batch
+        self.ready: "queue.Queue[Tuple[Job, Any]]" = queue.Queue()
+        self.results: "queue.Queue[Tuple[Job, dict]]" = queue.Queue()
+        self.download_pool = ThreadPoolExecutor(
+            max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download"
+        )
+        self.db_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="db-fail")
+        self.stopping = threading.Event()
+        # Set when the worker gave up after repeated database failures
+        self.fatal = False
+        self._db_failures = 0
+        self._db_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run_inference, name="inference", daemon=True),
+            threading.Thread(target=self._run_writer, name="db-writer", daemon=True),
+        ]
+
+    def start(self) -> None:
+        """Start the inference and writer threads."""
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Stop accepting work and wait for the pipeline threads to exit."""
+        self.stopping.set()
+        # Drop queued work too: interpreter exit still joins pool threads, and
+        # queued fail_job calls would each wait out the DB pool timeout during
+        # an outage, delaying the restart. Unacked messages are redelivered.
+        self.download_pool.shutdown(wait=False, cancel_futures=True)
+        self.db_pool.shutdown(wait=False, cancel_futures=True)
+        for thread in self.threads:
+            thread.join(timeout=POLL_INTERVAL * 2)
+
+    def on_message(self, ch, method, properties, body):
+        """Parse a job message and start fetching its image.
+
+        Args:
+            ch: Channel
+            method: Method frame
+            properties: Message properties
+            body: Message body bytes
+        """
+        job_id = None
+        # Recorded with the final status update instead of a separate
+        # start_processing transaction, so each job costs a single commit
+        started_at = datetime.now(timezone.utc)
+        try:
+            message = orjson.loads(body)
+            job_id = message["job_id"]
+            job = Job(method.delivery_tag, job_id, message["s3_key"], started_at)
+        except Exception as e:
+            self.fail(method.delivery_tag, job_id, e, started_at)
+            return
+
+        logger.info(f"Processing job {job.job_id}, image: {job.s3_key}")
+        future = self.download_pool.submit(fetch_image, job.s3_key)
+        future.add_done_callback(lambda f, job=job: self._on_downloaded(job, f))
 
-        logger.info(f"Processing job {job_id}, image: {s3_key}")
+    def _on_downloaded(self, job: Job, future) -> None:
+        if future.cancelled():
+            # Worker is stopping; the message is redelivered
+            return
+        try:
+            image = future.result()
+        except Exception as e:
+            self.fail(job.delivery_tag, job.job_id, e, job.started_at)
+            return
+        self.ready.put((job, image))
 
-        # Mark job as processing
-        start_processing(job_id)
+    def _next_batch(self) -> List[Tuple[Job, Any]]:
+        """Block for the first ready image, then take any others already waiting."""
+        try:
+            batch = [self.ready.get(timeout=POLL_INTERVAL)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.ready.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-        # Download image from MinIO
-        logger.info(f"Downloading image from {s3_key}")
-        image_bytes = download_image(s3_key)
-        logger.info(f"Downloaded {len(image_bytes)} bytes")
+    def _run_inference(self) -> None:
+        while not self.stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                self.process_batch(batch)
 
-        # Run YOLO inference
-        logger.info("Running model inference...")
-        result = run_inference(image_bytes)
+    def _run_writer(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                job, result = self.results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            try:
+                self.complete(job, result)
+            except psycopg.OperationalError as e:
+                self._record_db_result(ok=False)
+                # Already counted: the job's fail_job must not count it again
+                self.fail(
+                    job.delivery_tag, job.job_id, e, job.started_at, track_db=False
+                )
+            except Exception as e:
+                self.fail(job.delivery_tag, job.job_id, e, job.started_at)
+            else:
+                self._record_db_result(ok=True)
 
-        # Save results to database
-        logger.info("Saving results to database...")
+    def process_batch(self, batch: List[Tuple[Job, Any]]) -> None:
+        """Run one batch through the model and queue each result for saving.
+
+        Args:
+            batch: (job, decoded image) pairs
+        """
+        jobs = [job for job, _ in batch]
+        logger.info(f"Running model inference on {len(jobs)} image(s)...")
+        results = run_batch_inference([image for _, image in batch])
+        for index, job in enumerate(jobs):
+            try:
+                result = next(results)
+            except Exception as e:
+                # Inference itself failed: this and all remaining jobs fail
+                for remaining in jobs[index:]:
+                    self.fail(
+                        remaining.delivery_tag, remaining.job_id, e, remaining.started_at
+                    )
+                break
+            self.results.put((job, result))
+
+    def complete(self, job: Job, result: dict) -> None:
+        """Save an inference result and acknowledge its message.
+
+        Args:
+            job: The job the result belongs to
+            result: Result dictionary from the inference module
+        """
         save_result(
-            job_id=job_id,
+            job_id=job.job_id,
             count_viable=result["counts"]["viable"],
             count_apoptosis=result["counts"]["apoptosis"],
             count_other=result["counts"]["other"],
             avg_confidence=result["avg_confidence"],
-            raw_data={"bounding_boxes": result["bounding_boxes"]},
-            summary=result["summary"],
+            # Columnar layout: keys are stored once instead of per box
+            raw_data=result["bounding_boxes"],
+            summary=format_summary(result["bins"]),
+            started_at=job.started_at,
         )
 
         logger.info(
-            f"Job {job_id} completed: {result['counts']}, "
+            f"Job {job.job_id} completed: {result['counts']}, "
             f"total={sum(result['counts'].values())} cells"
         )
 
         # Acknowledge message
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.connection.add_callback_threadsafe(
+            functools.partial(self.channel.basic_ack, delivery_tag=job.delivery_tag)
+        )
 
-    except Exception as e:
-        logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+    def fail(
+        self,
+        delivery_tag: int,
+        job_id,
+        error: Exception,
+        started_at=None,
+        track_db: bool = True,
+    ) -> None:
+        """Record a job failure and reject its message.
+
+        Args:
+            delivery_tag: Delivery tag of the message to reject
+            job_id: The job ID, or None if the message could not be parsed
+            error: The exception that caused the failure
+            started_at: When processing began
+            track_db: Whether the fail_job outcome counts towards
+                MAX_DB_FAILURES (False when the job already counted once)
+        """
+        logger.error(f"Job {job_id} failed: {error}", exc_info=error)
+        # Reject message without requeue (send to dead letter if configured)
+        self.connection.add_callback_threadsafe(
+            functools.partial(
+                self.channel.basic_nack, delivery_tag=delivery_tag, requeue=False
+            )
+        )
         if job_id is not None:
+            error_message = str(error)[:500]  # Limit error message length
             try:
-                fail_job(job_id, str(e)[:500])  # Limit error message length
-            except Exception as db_err:
-                logger.error(f"Failed to update job status: {db_err}")
-        # Reject message without requeue (send to dead letter if configured)
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                future = self.db_pool.submit(fail_job, job_id, error_message, started_at)
+            except RuntimeError:
+                # Pool already shut down: the worker is stopping
+                return
+            future.add_done_callback(
+                functools.partial(self._on_fail_job_done, track_db=track_db)
+            )
+
+    def _on_fail_job_done(self, future, track_db: bool) -> None:
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Failed to update job status: {error}")
+        # Only connection-level errors (including pool timeouts) count: other
+        # errors, e.g. a unique violation for a redelivered job, mean the
+        # database is reachable
+        if track_db and (error is None or isinstance(error, psycopg.OperationalError)):
+            self._record_db_result(ok=error is None)
+
+    def _record_db_result(self, ok: bool) -> None:
+        """Track consecutive database failures and give up past the limit."""
+        with self._db_lock:
+            self._db_failures = 0 if ok else self._db_failures + 1
+            if self._db_failures < MAX_DB_FAILURES or self.fatal:
+                return
+            self.fatal = True
+        logger.critical(
+            f"{MAX_DB_FAILURES} consecutive database failures, stopping worker"
+        )
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
 
 
 def connect_with_retry(max_retries: int = 30, retry_delay: float = 2.0):
@@ -127,6 +350,10 @@ def main():
     logger.info(f"MinIO: {config.minio_endpoint}")
     logger.info(f"Model: {config.model_path}")
 
+    # Load the model before connecting, so a slow first-time export or
+    # warmup cannot starve the RabbitMQ heartbeat
+    max_batch = get_model().batch_size
+
     # Connect to RabbitMQ with retry
     connection = connect_with_retry()
     channel = connection.channel()
@@ -134,12 +361,15 @@ def main():
     # Declare queue (idempotent - creates if not exists)
     channel.queue_declare(queue=config.analysis_queue, durable=True)
 
-    # Fair dispatch - only process 1 message at a time
-    channel.basic_qos(prefetch_count=1)
+    # Enough unacked messages to keep every pipeline stage busy: one per
+    # download worker, one batch waiting in the ready queue and one in the model
+    channel.basic_qos(prefetch_count=DOWNLOAD_WORKERS + 2 * max_batch)
 
     # Start consuming
+    scheduler = BatchScheduler(connection, channel, max_batch)
+    scheduler.start()
     channel.basic_consume(
-        queue=config.analysis_queue, on_message_callback=process_message
+        queue=config.analysis_queue, on_message_callback=scheduler.on_message
     )
 
     logger.info(f"Worker ready. Waiting for messages on '{config.analysis_queue}'...")
@@ -150,9 +380,14 @@ def main():
         logger.info("Worker shutting down...")
         channel.stop_consuming()
     finally:
+        scheduler.stop()
         connection.close()
         logger.info("Connection closed")
 
+    if scheduler.fatal:
+        # Non-zero exit so the container is restarted
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
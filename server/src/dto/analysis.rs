@@ -94,6 +94,63 @@ pub struct RawDetectionData {
     pub bounding_boxes: Vec<BoundingBox>,
 }
 
+/// Raw detection data in the columnar (struct-of-arrays) layout written by
+/// the model worker: one array per bounding box field.
+#[derive(Debug, Clone, Deserialize)]
+pub struct ColumnarDetectionData {
+    pub class: Vec<String>,
+    pub confidence: Vec<f64>,
+    pub x: Vec<i32>,
+    pub y: Vec<i32>,
+    pub width: Vec<i32>,
+    pub height: Vec<i32>,
+}
+
+impl From<ColumnarDetectionData> for RawDetectionData {
+    fn from(columns: ColumnarDetectionData) -> Self {
+        let bounding_boxes = columns
+            .class
+            .into_iter()
+            .zip(columns.confidence)
+            .zip(columns.x)
+            .zip(columns.y)
+            .zip(columns.width)
+            .zip(columns.height)
+            .map(
+                |(((((class, confidence), x), y), width), height)| BoundingBox {
+                    class,
+                    confidence,
+                    x,
+                    y,
+                    width,
+                    height,
+                },
+            )
+            .collect();
+
+        Self { bounding_boxes }
+    }
+}
+
+/// `analysis_results.raw_data` as stored in the database.
+///
+/// Older rows hold a list of bounding box objects; newer rows hold columns.
+#[derive(Debug, Clone, Deserialize)]
+#[serde(untagged)]
+pub enum StoredDetectionData {
+    Rows(RawDetectionData),
+    Columns(ColumnarDetectionData),
+}
+
+impl From<StoredDetectionData> for RawDetectionData {
+    fn from(stored: StoredDetectionData) -> Self {
+        match stored {
+            StoredDetectionData::Rows(data) => data,
+            StoredDetectionData::Columns(columns) => columns.into(),
+        }
+    }
+}
+
 /// Analysis result response
 #[derive(Debug, Clone, Serialize, ToSchema)]
 pub struct AnalysisResultResponse {
@@ -132,3 +189,44 @@ pub struct AnalysisHistorySummary {
     #[serde(skip_serializing_if = "Option::is_none")]
     pub finished_at: Option<String>,
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use serde_json::json;
+
+    #[test]
+    fn test_stored_detection_data_rows() {
+        let value = json!({
+            "bounding_boxes": [
+                {"class": "normal", "confidence": 0.9, "x": 1, "y": 2, "width": 3, "height": 4}
+            ]
+        });
+        let stored: StoredDetectionData = serde_json::from_value(value).unwrap();
+        let data = RawDetectionData::from(stored);
+        assert_eq!(data.bounding_boxes.len(), 1);
+        assert_eq!(data.bounding_boxes[0].class, "normal");
+    }
+
+    #[test]
+    fn test_stored_detection_data_columns() {
+        let value = json!({
+            "class": ["normal", "apoptosis"],
+            "confidence": [0.9, 0.75],
+            "x": [1, 10],
+            "y": [2, 20],
+            "width": [3, 30],
+            "height": [4, 40]
+        });
+        let stored: StoredDetectionData = serde_json::from_value(value).unwrap();
+        let data = RawDetectionData::from(stored);
+        assert_eq!(data.bounding_boxes.len(), 2);
+        let second = &data.bounding_boxes[1];
+        assert_eq!(second.class, "apoptosis");
+        assert_eq!(second.confidence, 0.75);
+        assert_eq!(
+            (second.x, second.y, second.width, second.height),
+            (10, 20, 30, 40)
+        );
+    }
+}
@@ -8,8 +8,8 @@ use sqlx::PgPool;
 use crate::domain::ApiResponse;
 use crate::dto::analysis::{
     AnalysisHistorySummary, AnalysisResultResponse, AnalyzeImageRequest, AnalyzeImageResponse,
-    CellCounts, CellPercentages, ImageAnalysisHistoryResponse, JobStatusResponse,
-    RawDetectionData,
+    CellCounts, CellPercentages, ImageAnalysisHistoryResponse, JobStatusResponse, RawDetectionData,
+    StoredDetectionData,
 };
 use crate::middleware::AuthenticatedUser;
 use crate::models::job::JobStatus;
@@ -244,8 +244,8 @@ pub async fn get_job_result(
     };
 
     let raw_data = result.raw_data.clone().and_then(|data| {
-        match serde_json::from_value::<RawDetectionData>(data.clone()) {
-            Ok(d) => Some(d),
+        match serde_json::from_value::<StoredDetectionData>(data.clone()) {
+            Ok(d) => Some(RawDetectionData::from(d)),
             Err(e) => {
                 tracing::error!("Failed to parse raw_data for result_id {}: {:?}. Data: {:?}", result.result_id, e, data);
                 None